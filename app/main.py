@@ -1,22 +1,45 @@
-from datetime import datetime
-from typing import Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+from urllib.parse import quote, urlencode
 import os
+import hashlib
 import secrets
+import time
 from uuid import uuid4
 from pathlib import Path
 
+import aiofiles
+import aiofiles.os
 from fastapi import FastAPI, Request, Form, UploadFile, File, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import select, or_, func
-from sqlalchemy.orm import Session
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from sqlalchemy import select, or_, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only, selectinload
 
 from .db import SessionLocal, engine
 from .models import Base, Report, Attachment
+from .cache import TTLCache
 
-app = FastAPI(title="Scam Report Hub")
+
+# Deployments that apply create_schema.psql / upgrade_schema.sql can skip the startup reflection.
+AUTO_CREATE_SCHEMA = os.getenv("AUTO_CREATE_SCHEMA", "1") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_CREATE_SCHEMA:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    yield
+    await engine.dispose()
+
+
+app = FastAPI(title="Scam Report Hub", lifespan=lifespan)
 
 security = HTTPBasic()
 
@@ -25,73 +48,132 @@ ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 if not ADMIN_USER or not ADMIN_PASSWORD:
     raise RuntimeError("ADMIN_USER and ADMIN_PASSWORD must be set in the environment.")
 
-Base.metadata.create_all(bind=engine)
-
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-templates = Jinja2Templates(directory="app/templates")
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("app/templates"),
+        autoescape=True,
+        bytecode_cache=FileSystemBytecodeCache(),
+        cache_size=400,
+        auto_reload=os.getenv("TEMPLATE_AUTO_RELOAD", "0") == "1",
+    )
+)
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20
+# When set (e.g. "/_protected/"), downloads are handed to nginx via X-Accel-Redirect.
+ATTACHMENT_ACCEL_PREFIX = os.getenv("ATTACHMENT_ACCEL_PREFIX")
 
+# Mixed into page ETags so a deploy with new templates invalidates clients' cached HTML.
+BUILD_ID = os.getenv("RENDER_GIT_COMMIT") or uuid4().hex
 
-def get_db() -> Session:
-    return SessionLocal()
+# Rendered public feed pages keyed by feed version; a hit skips the feed and attachment queries.
+FEED_CACHE_TTL = 30.0
+_feed_cache = TTLCache(max_entries=256)
 
+ADMIN_PAGE_SIZE = 25
+ADMIN_COUNTS_TTL = 30.0
+_admin_counts_cache: dict[str, tuple[float, tuple[int, int, int]]] = {}
 
-@app.get("/", response_class=HTMLResponse)
-def search_page(request: Request, q: Optional[str] = None, report_type: Optional[str] = None):
-    with get_db() as db:
-        stmt = (
-            select(Report)
-            .where(Report.deleted.is_(False), Report.is_flagged.is_(False))
-            .order_by(Report.created_on.desc())
-            .limit(200)
-        )
 
-        if report_type and report_type != "all":
-            stmt = stmt.where(Report.report_type == report_type)
-
-        if q:
-            like = f"%{q}%"
-            stmt = stmt.where(
-                or_(
-                    Report.message_content.ilike(like),
-                    Report.source_from.ilike(like),
-                    Report.subject.ilike(like),
-                )
-            )
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with SessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
 
-        reports = db.execute(stmt).scalars().all()
-        report_ids = [r.id for r in reports]
-        attachments_map = {}
-        if report_ids:
-            att_stmt = select(Attachment).where(
-                Attachment.report_id.in_(report_ids),
-                Attachment.deleted.is_(False),
+@app.get("/", response_class=HTMLResponse)
+async def search_page(
+    request: Request,
+    q: Optional[str] = None,
+    report_type: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    # updated_on is the writing transaction's start time, so a late-committing flag/delete may not
+    # move its max; the visible-row count changes on every insert, flag, unflag and delete.
+    version_stmt = select(
+        func.max(Report.updated_on),
+        func.count().filter(Report.deleted.is_(False), Report.is_flagged.is_(False)),
+    )
+    last_updated, visible_count = (await db.execute(version_stmt)).one()
+    feed_version = hashlib.md5(
+        f"{BUILD_ID}|{last_updated}|{visible_count}|{q}|{report_type}".encode()
+    ).hexdigest()
+    etag = f'W/"{feed_version}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=10"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    html = _feed_cache.get(feed_version)
+    if html is not None:
+        return HTMLResponse(html, headers=cache_headers)
+
+    stmt = (
+        select(Report)
+        .options(
+            load_only(
+                Report.report_type,
+                Report.source_from,
+                Report.subject,
+                Report.message_content,
+                Report.received_at,
+                Report.classification,
+                Report.is_verified,
+                Report.created_on,
+                raiseload=True,
+            ),
+            selectinload(Report.attachments),
+        )
+        .where(Report.deleted.is_(False), Report.is_flagged.is_(False))
+        .order_by(Report.created_on.desc())
+        .limit(200)
+    )
+
+    if report_type and report_type != "all":
+        stmt = stmt.where(Report.report_type == report_type)
+
+    if q:
+        like = f"%{q}%"
+        stmt = stmt.where(
+            or_(
+                Report.message_content.ilike(like),
+                Report.source_from.ilike(like),
+                Report.subject.ilike(like),
             )
-            attachments = db.execute(att_stmt).scalars().all()
-            for att in attachments:
-                attachments_map.setdefault(att.report_id, []).append(att)
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "reports": reports,
-                "attachments_map": attachments_map,
-                "q": q or "",
-                "report_type": report_type or "all",
-            },
         )
 
+    reports = (await db.execute(stmt)).scalars().all()
+    html = templates.get_template("index.html").render(
+        {
+            "request": request,
+            "reports": reports,
+            "q": q or "",
+            "report_type": report_type or "all",
+        }
+    )
+    _feed_cache.set(feed_version, html, FEED_CACHE_TTL)
+    return HTMLResponse(html, headers=cache_headers)
+
 
 @app.get("/submit", response_class=HTMLResponse)
-def submit_form(request: Request):
+async def submit_form(request: Request):
     return templates.TemplateResponse("submit.html", {"request": request})
 
 
 @app.post("/submit")
-def submit_report(
+async def submit_report(
     report_type: str = Form(...),
     source_from: str = Form(""),
     subject: str = Form(""),
@@ -101,53 +183,103 @@ def submit_report(
     reporter_contact: str = Form(""),
     suggested_classification: str = Form("unclassified"),
     attachment: UploadFile | None = File(None),
+    db: AsyncSession = Depends(get_db),
 ):
-    with get_db() as db:
-        parsed_received_at = None
-        if received_at:
+    parsed_received_at = None
+    if received_at:
+        try:
+            parsed_received_at = datetime.fromisoformat(received_at)
+        except ValueError:
+            parsed_received_at = None
+
+    has_contact = bool(reporter_contact.strip())
+    report = Report(
+        report_type=report_type,
+        source_from=source_from or None,
+        subject=subject or None,
+        message_content=message_content,
+        received_at=parsed_received_at,
+        reporter_name=reporter_name or None,
+        reporter_contact=reporter_contact or None,
+        suggested_classification=suggested_classification,
+        classification=suggested_classification,
+        is_verified=has_contact,
+    )
+
+    attachment_row = None
+    created_path = None
+    if attachment and attachment.filename:
+        original_name = attachment.filename
+        suffix = Path(original_name).suffix
+        tmp_path = UPLOAD_DIR / f"{uuid4().hex}.part"
+        size_bytes = 0
+        hasher = hashlib.sha256()
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                while chunk := await attachment.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+                    size_bytes += len(chunk)
+                    hasher.update(chunk)
+
+            # Content-addressed: identical uploads share one file on disk.
+            checksum = hasher.hexdigest()
+            dest_path = UPLOAD_DIR / f"{checksum}{suffix}"
+            if await aiofiles.os.path.exists(dest_path):
+                await aiofiles.os.remove(tmp_path)
+            else:
+                await aiofiles.os.replace(tmp_path, dest_path)
+                created_path = dest_path
+        except BaseException:
             try:
-                parsed_received_at = datetime.fromisoformat(received_at)
-            except ValueError:
-                parsed_received_at = None
-
-        has_contact = bool(reporter_contact.strip())
-        report = Report(
-            report_type=report_type,
-            source_from=source_from or None,
-            subject=subject or None,
-            message_content=message_content,
-            received_at=parsed_received_at,
-            reporter_name=reporter_name or None,
-            reporter_contact=reporter_contact or None,
-            suggested_classification=suggested_classification,
-            classification=suggested_classification,
-            is_verified=has_contact,
+                await aiofiles.os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        attachment_row = Attachment(
+            original_name=original_name,
+            storage_path=str(dest_path),
+            mime_type=attachment.content_type,
+            size_bytes=size_bytes,
+            checksum=checksum,
         )
 
-        db.add(report)
-        db.commit()
-        db.refresh(report)
-
-        if attachment and attachment.filename:
-            original_name = attachment.filename
-            suffix = Path(original_name).suffix
-            safe_name = f"{uuid4().hex}{suffix}"
-            dest_path = UPLOAD_DIR / safe_name
-            with dest_path.open("wb") as f:
-                f.write(attachment.file.read())
-
-            db.add(
-                Attachment(
-                    report_id=report.id,
-                    original_name=original_name,
-                    storage_path=str(dest_path),
-                    mime_type=attachment.content_type,
-                    size_bytes=dest_path.stat().st_size,
-                )
-            )
-            db.commit()
+    # One transaction: flush() gets report.id via INSERT ... RETURNING, no refresh needed.
+    try:
+        async with db.begin():
+            db.add(report)
+            if attachment_row is not None:
+                await db.flush()
+                attachment_row.report_id = report.id
+                db.add(attachment_row)
+    except BaseException:
+        # Only drop a file this request wrote; a deduplicated one belongs to existing rows.
+        if created_path is not None:
+            try:
+                await aiofiles.os.remove(created_path)
+            except FileNotFoundError:
+                pass
+        raise
 
-        return RedirectResponse(url="/", status_code=303)
+    _admin_counts_cache.clear()
+    return RedirectResponse(url="/", status_code=303)
+
+
+# (total, flagged, deleted) in one scan, cached briefly and cleared on writes.
+async def get_admin_counts(db: AsyncSession) -> tuple[int, int, int]:
+    cached = _admin_counts_cache.get("counts")
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        return cached[1]
+
+    stmt = select(
+        func.count(),
+        func.count().filter(Report.is_flagged.is_(True)),
+        func.count().filter(Report.deleted.is_(True)),
+    ).select_from(Report)
+    counts = tuple((await db.execute(stmt)).one())
+    _admin_counts_cache["counts"] = (now + ADMIN_COUNTS_TTL, counts)
+    return counts
 
 
 def require_admin(credentials: HTTPBasicCredentials = Depends(security)) -> str:
@@ -158,132 +290,211 @@ def require_admin(credentials: HTTPBasicCredentials = Depends(security)) -> str:
     return credentials.username
 
 
+def admin_filters(status: str, show_deleted: int, q: str) -> list:
+    filters = []
+    if not show_deleted:
+        filters.append(Report.deleted.is_(False))
+    if status == "flagged":
+        filters.append(Report.is_flagged.is_(True))
+    elif status == "unflagged":
+        filters.append(Report.is_flagged.is_(False))
+    if q:
+        like = f"%{q}%"
+        filters.append(
+            or_(
+                Report.message_content.ilike(like),
+                Report.source_from.ilike(like),
+                Report.subject.ilike(like),
+            )
+        )
+    return filters
+
+
+async def load_admin_rows(
+    db: AsyncSession,
+    filters: list,
+    status: str,
+    show_deleted: int,
+    q: str,
+    before_created: Optional[datetime],
+    before_id: Optional[int],
+) -> dict:
+    # Keyset pagination: seek past the last row of the previous page instead of OFFSET.
+    stmt = select(Report).options(
+        load_only(
+            Report.report_type,
+            Report.source_from,
+            Report.subject,
+            Report.message_content,
+            Report.suggested_classification,
+            Report.classification,
+            Report.is_verified,
+            Report.is_flagged,
+            Report.flag_reason,
+            Report.deleted,
+            Report.created_on,
+            raiseload=True,
+        )
+    )
+    if filters:
+        stmt = stmt.where(*filters)
+    if before_created is not None and before_id is not None:
+        stmt = stmt.where(tuple_(Report.created_on, Report.id) < tuple_(before_created, before_id))
+    stmt = stmt.order_by(Report.created_on.desc(), Report.id.desc()).limit(ADMIN_PAGE_SIZE + 1)
+
+    reports = (await db.execute(stmt)).scalars().all()
+    filter_query = urlencode({"status": status, "show_deleted": show_deleted, "q": q})
+    next_query = None
+    if len(reports) > ADMIN_PAGE_SIZE:
+        reports = reports[:ADMIN_PAGE_SIZE]
+        last = reports[-1]
+        next_query = filter_query + "&" + urlencode(
+            {"before_created": last.created_on.isoformat(), "before_id": last.id}
+        )
+    return {
+        "reports": reports,
+        "is_first_page": before_id is None,
+        "filter_query": filter_query,
+        "next_query": next_query,
+    }
+
+
 @app.get("/admin", response_class=HTMLResponse)
-def admin_page(
+async def admin_page(
     request: Request,
     admin_user: str = Depends(require_admin),
     status: str = "all",
     show_deleted: int = 0,
     q: str = "",
-    page: int = 1,
+    before_created: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
 ):
-    with get_db() as db:
-        page_size = 25
-        page = max(page, 1)
-
-        total_all = db.execute(select(func.count()).select_from(Report)).scalar_one()
-        total_flagged = db.execute(
-            select(func.count()).select_from(Report).where(Report.is_flagged.is_(True))
-        ).scalar_one()
-        total_deleted = db.execute(
-            select(func.count()).select_from(Report).where(Report.deleted.is_(True))
-        ).scalar_one()
-
-        filters = []
-        if not show_deleted:
-            filters.append(Report.deleted.is_(False))
-        if status == "flagged":
-            filters.append(Report.is_flagged.is_(True))
-        elif status == "unflagged":
-            filters.append(Report.is_flagged.is_(False))
-        if q:
-            like = f"%{q}%"
-            filters.append(
-                or_(
-                    Report.message_content.ilike(like),
-                    Report.source_from.ilike(like),
-                    Report.subject.ilike(like),
-                )
-            )
-
-        count_stmt = select(func.count()).select_from(Report)
-        if filters:
-            count_stmt = count_stmt.where(*filters)
-        total = db.execute(count_stmt).scalar_one()
-
-        stmt = select(Report)
-        if filters:
-            stmt = stmt.where(*filters)
-        stmt = stmt.order_by(Report.created_on.desc()).limit(page_size).offset((page - 1) * page_size)
-
-        reports = db.execute(stmt).scalars().all()
-        total_pages = max((total + page_size - 1) // page_size, 1)
-        return templates.TemplateResponse(
-            "admin.html",
-            {
-                "request": request,
-                "reports": reports,
-                "admin_user": admin_user,
-                "status": status,
-                "show_deleted": show_deleted,
-                "q": q,
-                "page": page,
-                "total_pages": total_pages,
-                "total": total,
-                "total_all": total_all,
-                "total_flagged": total_flagged,
-                "total_deleted": total_deleted,
-            },
-        )
+    total_all, total_flagged, total_deleted = await get_admin_counts(db)
+
+    filters = admin_filters(status, show_deleted, q)
+    rows = await load_admin_rows(db, filters, status, show_deleted, q, before_created, before_id)
+    return templates.TemplateResponse(
+        "admin.html",
+        {
+            "request": request,
+            "admin_user": admin_user,
+            "status": status,
+            "show_deleted": show_deleted,
+            "q": q,
+            "total_all": total_all,
+            "total_flagged": total_flagged,
+            "total_deleted": total_deleted,
+            **rows,
+        },
+    )
+
+
+# HTMX pagination target: only the report rows, without the counters and filter form.
+@app.get("/admin/rows", response_class=HTMLResponse)
+async def admin_rows(
+    request: Request,
+    admin_user: str = Depends(require_admin),
+    status: str = "all",
+    show_deleted: int = 0,
+    q: str = "",
+    before_created: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    filters = admin_filters(status, show_deleted, q)
+    rows = await load_admin_rows(db, filters, status, show_deleted, q, before_created, before_id)
+    return templates.TemplateResponse("admin_rows.html", {"request": request, **rows})
 
 
 @app.post("/admin/action")
-def admin_action(
+async def admin_action(
     report_id: int = Form(...),
     action: str = Form(...),
     reason: str = Form(""),
     classification: str = Form("unclassified"),
     admin_user: str = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
 ):
-    with get_db() as db:
-        report = db.get(Report, report_id)
-        if not report or report.deleted:
-            return RedirectResponse(url="/admin", status_code=303)
-
-        now = datetime.utcnow()
-        if action == "flag":
-            report.is_flagged = True
-            report.flag_reason = reason or "flagged by admin"
-            report.flagged_on = now
-            report.flagged_by = admin_user
-        elif action == "unflag":
-            report.is_flagged = False
-            report.flag_reason = None
-            report.flagged_on = None
-            report.flagged_by = None
-        elif action == "classify":
-            report.classification = classification
-            report.classified_by = admin_user
-            report.classified_on = now
-        elif action == "verify":
-            report.is_verified = True
-            report.verified_by = admin_user
-            report.verified_on = now
-        elif action == "unverify":
-            report.is_verified = False
-            report.verified_by = None
-            report.verified_on = None
-        elif action == "delete":
-            report.deleted = True
-            report.deleted_on = now
-
-        db.commit()
+    report = await db.get(Report, report_id)
+    if not report or report.deleted:
         return RedirectResponse(url="/admin", status_code=303)
 
+    now = datetime.now(timezone.utc)
+    if action == "flag":
+        report.is_flagged = True
+        report.flag_reason = reason or "flagged by admin"
+        report.flagged_on = now
+        report.flagged_by = admin_user
+    elif action == "unflag":
+        report.is_flagged = False
+        report.flag_reason = None
+        report.flagged_on = None
+        report.flagged_by = None
+    elif action == "classify":
+        report.classification = classification
+        report.classified_by = admin_user
+        report.classified_on = now
+    elif action == "verify":
+        report.is_verified = True
+        report.verified_by = admin_user
+        report.verified_on = now
+    elif action == "unverify":
+        report.is_verified = False
+        report.verified_by = None
+        report.verified_on = None
+    elif action == "delete":
+        report.deleted = True
+        report.deleted_on = now
+
+    await db.commit()
+    _admin_counts_cache.clear()
+    return RedirectResponse(url="/admin", status_code=303)
+
 
 @app.get("/attachments/{attachment_id}")
-def download_attachment(attachment_id: int):
-    with get_db() as db:
-        att = db.get(Attachment, attachment_id)
-        if not att or att.deleted:
-            return RedirectResponse(url="/", status_code=303)
-
-        report = db.get(Report, att.report_id)
-        if not report or report.deleted or report.is_flagged:
-            return RedirectResponse(url="/", status_code=303)
-
-        return FileResponse(
-            path=att.storage_path,
-            filename=att.original_name,
-            media_type=att.mime_type or "application/octet-stream",
+async def download_attachment(request: Request, attachment_id: int, db: AsyncSession = Depends(get_db)):
+    stmt = (
+        select(Attachment)
+        .join(Report, Report.id == Attachment.report_id)
+        .where(
+            Attachment.id == attachment_id,
+            Attachment.deleted.is_(False),
+            Report.deleted.is_(False),
+            Report.is_flagged.is_(False),
         )
+    )
+    att = (await db.execute(stmt)).scalar_one_or_none()
+    if not att:
+        return RedirectResponse(url="/", status_code=303)
+
+    # no-cache makes clients revalidate each use, so a flagged or deleted report stops serving its files.
+    cache_headers = {
+        "ETag": f'W/"{att.id}-{att.size_bytes}"',
+        "Cache-Control": "private, no-cache",
+    }
+    if etag_matches(request, cache_headers["ETag"]):
+        return Response(status_code=304, headers=cache_headers)
+
+    media_type = att.mime_type or "application/octet-stream"
+    if ATTACHMENT_ACCEL_PREFIX:
+        quoted_name = quote(att.original_name)
+        if quoted_name != att.original_name:
+            content_disposition = f"attachment; filename*=utf-8''{quoted_name}"
+        else:
+            content_disposition = f'attachment; filename="{att.original_name}"'
+        return Response(
+            headers={
+                "X-Accel-Redirect": ATTACHMENT_ACCEL_PREFIX.rstrip("/") + "/" + Path(att.storage_path).name,
+                "Content-Disposition": content_disposition,
+                **cache_headers,
+            },
+            media_type=media_type,
+        )
+
+    return FileResponse(
+        path=att.storage_path,
+        filename=att.original_name,
+        media_type=media_type,
+        headers=cache_headers,
+    )
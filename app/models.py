@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, Text, DateTime, Boolean, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, Text, DateTime, Boolean, ForeignKey, BigInteger, Index, DDL, event
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 from .db import Base
@@ -6,6 +7,30 @@ from .db import Base
 
 class Report(Base):
     __tablename__ = "reports"
+    __table_args__ = (
+        Index("reports_public_feed_idx", "deleted", "is_flagged", "created_on"),
+        Index("reports_admin_feed_idx", "deleted", "created_on", "id"),
+        Index("reports_updated_on_idx", "updated_on"),
+        # Trigram indexes let Postgres serve the ILIKE '%q%' searches without a full scan.
+        Index(
+            "reports_message_trgm",
+            "message_content",
+            postgresql_using="gin",
+            postgresql_ops={"message_content": "gin_trgm_ops"},
+        ),
+        Index(
+            "reports_source_trgm",
+            "source_from",
+            postgresql_using="gin",
+            postgresql_ops={"source_from": "gin_trgm_ops"},
+        ),
+        Index(
+            "reports_subject_trgm",
+            "subject",
+            postgresql_using="gin",
+            postgresql_ops={"subject": "gin_trgm_ops"},
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     report_type = Column(Text, nullable=False)  # sms | email | call
@@ -35,9 +60,18 @@ class Report(Base):
     updated_on = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     deleted = Column(Boolean, server_default="false", nullable=False)
 
+    # Live attachments only; load explicitly with selectinload() since lazy IO is unavailable under asyncio.
+    attachments = relationship(
+        "Attachment",
+        primaryjoin="and_(Report.id == Attachment.report_id, Attachment.deleted.is_(False))",
+        viewonly=True,
+        lazy="raise",
+    )
+
 
 class Attachment(Base):
     __tablename__ = "attachments"
+    __table_args__ = (Index("attachments_report_deleted_idx", "report_id", "deleted"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), nullable=False)
@@ -45,6 +79,13 @@ class Attachment(Base):
     storage_path = Column(Text, nullable=False)
     mime_type = Column(Text)
     size_bytes = Column(BigInteger)
+    checksum = Column(Text)  # sha256 hex of the stored file
 
     created_on = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     deleted = Column(Boolean, server_default="false", nullable=False)
+
+
+# Declared outside __table_args__ because DESC needs the column objects.
+Index("reports_created_id_idx", Report.created_on.desc(), Report.id.desc())
+
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
@@ -1,5 +1,7 @@
 -- Minimal schema upgrades for existing databases
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 ALTER TABLE public.reports
   ADD COLUMN IF NOT EXISTS suggested_classification text NOT NULL DEFAULT 'unclassified',
   ADD COLUMN IF NOT EXISTS classification text NOT NULL DEFAULT 'unclassified',
@@ -9,4 +11,15 @@ ALTER TABLE public.reports
   ADD COLUMN IF NOT EXISTS verified_by text,
   ADD COLUMN IF NOT EXISTS verified_on timestamptz;
 
+ALTER TABLE public.attachments
+  ADD COLUMN IF NOT EXISTS checksum text;
+
 CREATE INDEX IF NOT EXISTS reports_flagged_idx ON public.reports(is_flagged);
+CREATE INDEX IF NOT EXISTS reports_created_id_idx ON public.reports(created_on DESC, id DESC);
+CREATE INDEX IF NOT EXISTS reports_public_feed_idx ON public.reports(deleted, is_flagged, created_on);
+CREATE INDEX IF NOT EXISTS reports_admin_feed_idx ON public.reports(deleted, created_on, id);
+CREATE INDEX IF NOT EXISTS attachments_report_deleted_idx ON public.attachments(report_id, deleted);
+CREATE INDEX IF NOT EXISTS reports_message_trgm ON public.reports USING GIN (message_content gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS reports_source_trgm ON public.reports USING GIN (source_from gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS reports_subject_trgm ON public.reports USING GIN (subject gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS reports_updated_on_idx ON public.reports(updated_on);